@@ -6,12 +6,21 @@ graceful failures (RPC down), and clear logging for Render.
 """
 
 import os
+import secrets
 import re
 import logging
 import asyncio
-from functools import partial
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+import aiohttp
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
@@ -39,60 +48,155 @@ USDT_BSC_CONTRACT = os.environ.get(
 )
 BTC_API_BASE = os.environ.get("BTC_API_BASE", "https://blockstream.info/api/address/")
 TON_API_BASE = os.environ.get("TON_API_BASE", "https://toncenter.com/api/v2/getAddressBalance?address=")
+RPC_WORKERS = int(os.environ.get("RPC_WORKERS", "8"))
+# Webhook mode (production): set USE_WEBHOOK=1/true/yes and PUBLIC_URL (defaults to Render's external URL)
+USE_WEBHOOK = os.environ.get("USE_WEBHOOK", "").strip().lower() in ("1", "true", "yes")
+PORT = int(os.environ.get("PORT", "8443"))
+PUBLIC_URL = os.environ.get("PUBLIC_URL", os.environ.get("RENDER_EXTERNAL_URL", ""))
+# Telegram echoes this in X-Telegram-Bot-Api-Secret-Token; PTB rejects updates without it.
+# Random per process if unset (the webhook is re-registered with it on every start).
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# PTB processes updates one at a time unless told otherwise; without this the worker pool and
+# in-flight coalescing would never see concurrent checks
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "64"))
+CHECK_TIMEOUT = float(os.environ.get("CHECK_TIMEOUT", "12"))  # outer bound per check, seconds
+MIN_CHECK_TIMEOUT = 8.0  # keeps the RPC read timeout at 2.5s or more (see JSON-RPC transport)
 # --------------------------------------------------
 
 # Basic checks
 if not TOKEN:
     raise SystemExit("Error: TOKEN environment variable is required. Set it in Render secrets.")
+if USE_WEBHOOK and not PUBLIC_URL:
+    raise SystemExit("Error: PUBLIC_URL environment variable is required when USE_WEBHOOK is set.")
+if CHECK_TIMEOUT < MIN_CHECK_TIMEOUT:
+    raise SystemExit(f"Error: CHECK_TIMEOUT must be at least {MIN_CHECK_TIMEOUT:g} seconds.")
 
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger("address-checker-bot")
 
-# Regex address patterns
-RE_EVM = re.compile(r"^0x[0-9a-fA-F]{40}$")
+# Address patterns (EVM is a plain length/charset check; regex kept for BTC/TON)
+_HEX = frozenset("0123456789abcdefABCDEF")
 RE_BTC = re.compile(r"^(bc1|[13])[a-zA-HJ-NP-Z0-9]{25,39}$")
 RE_TON = re.compile(r"^(EQ|UQ)[A-Za-z0-9_-]{46}$")
 
-# user selection state
-user_choice = {}
+def is_evm(a: str) -> bool:
+    if len(a) != 42 or a[0] != "0" or a[1] != "x":
+        return False
+    return _HEX.issuperset(a[2:])
+
+# token -> (validator, error reply)
+_EVM_ERR = "❌ Invalid EVM-style address format (must be 0x...)."
+VALIDATORS = {
+    "BNB": (is_evm, _EVM_ERR),
+    "ETH": (is_evm, _EVM_ERR),
+    "USDT": (is_evm, _EVM_ERR),
+    "BTC": (RE_BTC.fullmatch, "❌ Invalid BTC address format."),
+    "TON": (RE_TON.fullmatch, "❌ Invalid TON address format."),
+}
+
+# user selection state; entries expire an hour after the last write, and handle_address
+# re-writes on every use, so only users idle for an hour are evicted
+user_choice = TTLCache(maxsize=50_000, ttl=3600)
 
 # ---------------- web3 helper (v5/v6 compatible) ----------------
-def to_checksum(addr: str) -> str:
-    if not WEB3_AVAILABLE:
+# API name is picked once at import instead of try/except on every call.
+if not WEB3_AVAILABLE:
+    def to_checksum(addr: str) -> str:
         raise RuntimeError("web3 library not available")
-    try:
-        return Web3.toChecksumAddress(addr)  # v5 naming
-    except AttributeError:
-        # v6 naming
-        return Web3.to_checksum_address(addr)
+else:
+    _to_checksum = getattr(Web3, "to_checksum_address", None) or Web3.toChecksumAddress  # v6 / v5 naming
+
+    @lru_cache(maxsize=4096)
+    def to_checksum(addr: str) -> str:
+        return _to_checksum(addr)
 # ---------------------------------------------------------------
 
+# ---------------- JSON-RPC transport ----------------
+# web3 6.2 has no batch_requests(), so batches are POSTed directly over a shared keep-alive session.
+# JSON-RPC reads are idempotent, so POSTs are retried with backoff on connect failures and
+# rate limits / gateway errors. Read timeouts are not retried (read=0): a slow but healthy node
+# gets one long read instead of the same request three times. Retry-After is ignored.
+# The read timeout is whatever CHECK_TIMEOUT leaves after all connect attempts and ~1s of backoff,
+# so a typical failing call ends near the outer timeout. This is not a hard bound on the worker
+# thread: requests' read timeout applies per socket read rather than to the whole response, DNS
+# lookups are not covered by the connect timeout, and status retries on slow error replies each
+# pay a full read, so an abandoned thread can occasionally outlive asyncio.wait_for.
+RPC_RETRIES = 2
+RPC_CONNECT_TIMEOUT = 1.5
+RPC_READ_TIMEOUT = CHECK_TIMEOUT - 1.0 - (RPC_RETRIES + 1) * RPC_CONNECT_TIMEOUT
+RPC_HTTP_TIMEOUT = (RPC_CONNECT_TIMEOUT, RPC_READ_TIMEOUT)
+_RPC_SESSION = requests.Session()
+_RPC_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=RPC_RETRIES,
+            read=0,
+            backoff_factor=0.2,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=frozenset({"POST"}),
+            respect_retry_after_header=False,
+        ),
+    ),
+)
+
+# Prebuilt batch bodies: only the (already checksummed, hex-only) addresses vary, so they are
+# %-formatted in instead of building and serialising request dicts per call.
+_NATIVE_BATCH_TMPL = (
+    '[{"jsonrpc":"2.0","id":0,"method":"eth_getBalance","params":["%s","latest"]},'
+    '{"jsonrpc":"2.0","id":1,"method":"eth_getTransactionCount","params":["%s","latest"]}]'
+)
+_TOKEN_BATCH_TMPL = (
+    '[{"jsonrpc":"2.0","id":0,"method":"eth_call","params":[{"to":"%s","data":"%s"},"latest"]},'
+    '{"jsonrpc":"2.0","id":1,"method":"eth_blockNumber","params":[]}]'
+)
+_BLOCK_NUMBER_BODY = '[{"jsonrpc":"2.0","id":0,"method":"eth_blockNumber","params":[]}]'
+_JSON_HEADERS = {"content-type": "application/json"}
+
+def rpc_batch(rpc_url: str, body: str, methods):
+    """POST a prebuilt JSON-RPC batch body (ids 0..n-1); return results in id order."""
+    r = _RPC_SESSION.post(rpc_url, data=body, headers=_JSON_HEADERS, timeout=RPC_HTTP_TIMEOUT)
+    r.raise_for_status()
+    data = orjson.loads(r.content)
+    if not isinstance(data, list):
+        # node rejected the batch as a whole
+        raise RuntimeError(data.get("error", data) if isinstance(data, dict) else data)
+    replies = {item.get("id"): item for item in data}
+    results = []
+    for i, method in enumerate(methods):
+        item = replies.get(i)
+        if item is None:
+            raise RuntimeError(f"missing reply for {method}")
+        if "error" in item:
+            raise RuntimeError(item["error"])
+        results.append(item["result"])
+    return results
+
+# balanceOf(address) selector; calldata is this plus the owner left-padded to 32 bytes,
+# so no ABI/Contract object is needed.
+BALANCE_OF_SELECTOR = "0x70a08231"
+
+def balance_of_calldata(owner: str) -> str:
+    return BALANCE_OF_SELECTOR + owner[2:].lower().rjust(64, "0")
+# -----------------------------------------------------
+
 # ---------------- sync blockchain checkers (run in threadpool) ----------------
 def sync_check_rpc_native(address: str, rpc_url: str):
     """Check native coin (BNB/ETH): return (ok:bool, message:str)"""
     if not WEB3_AVAILABLE:
         return False, "web3 not installed in environment"
     try:
-        w3 = Web3(Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": 10}))
-    except Exception as e:
-        return False, f"web3 provider init error: {e}"
-
-    try:
-        connected = False
-        try:
-            connected = w3.is_connected()
-        except Exception:
-            # older name fallback
-            try:
-                connected = w3.isConnected()
-            except Exception:
-                connected = False
-        if not connected:
-            return False, "Cannot connect to RPC node"
-
         cs_addr = to_checksum(address)
-        balance = w3.eth.get_balance(cs_addr)
-        txcount = w3.eth.get_transaction_count(cs_addr)
+        balance, txcount = (
+            int(x, 16)
+            for x in rpc_batch(
+                rpc_url,
+                _NATIVE_BATCH_TMPL % (cs_addr, cs_addr),
+                ("eth_getBalance", "eth_getTransactionCount"),
+            )
+        )
         # Format balances nicely
         return True, f"Balance: {balance / 1e18:.6f} (native), txs: {txcount}"
     except Exception as e:
@@ -103,48 +207,28 @@ def sync_check_rpc_token(address: str, rpc_url: str, token_contract: str):
     if not WEB3_AVAILABLE:
         return False, "web3 not installed in environment"
     try:
-        w3 = Web3(Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": 10}))
-    except Exception as e:
-        return False, f"web3 provider init error: {e}"
-
-    try:
-        connected = False
-        try:
-            connected = w3.is_connected()
-        except Exception:
-            try:
-                connected = w3.isConnected()
-            except Exception:
-                connected = False
-        if not connected:
-            return False, "Cannot connect to RPC node"
-
+        # checksumming doubles as validation before the addresses are formatted into the body
         cs_addr = to_checksum(address)
-        cs_token = to_checksum(token_contract)
-        # minimal ABI for balanceOf
-        abi = [
-            {
-                "constant": True,
-                "inputs": [{"name": "_owner", "type": "address"}],
-                "name": "balanceOf",
-                "outputs": [{"name": "balance", "type": "uint256"}],
-                "type": "function",
-            }
-        ]
-        token = w3.eth.contract(address=cs_token, abi=abi)
-        bal = token.functions.balanceOf(cs_addr).call()
+        raw, block = rpc_batch(
+            rpc_url,
+            _TOKEN_BATCH_TMPL % (to_checksum(token_contract), balance_of_calldata(cs_addr)),
+            ("eth_call", "eth_blockNumber"),
+        )
+        bal = int(raw, 16) if raw not in ("0x", None) else 0
+        block = int(block, 16)
         # USDT on BSC has 18 or 6 decimals depending on token; for our BSC USDT it's 18? (commonly 18)
         # We'll return raw and let user interpret; but format assuming 18 decimals for display.
-        return True, f"Token balance (raw): {bal}  (display approx: {bal / 1e18:.6f})"
+        return True, f"Token balance (raw): {bal}  (display approx: {bal / 1e18:.6f}), block: {block}"
     except Exception as e:
         return False, f"Token query error: {e}"
 
-def sync_check_btc(address: str):
+# ---------------- async HTTP checkers (shared aiohttp session) ----------------
+async def check_btc(session: aiohttp.ClientSession, address: str):
     try:
-        r = requests.get(BTC_API_BASE + address, timeout=10)
-        if r.status_code != 200:
-            return False, f"BTC API HTTP {r.status_code}"
-        j = r.json()
+        async with session.get(BTC_API_BASE + address) as r:
+            if r.status != 200:
+                return False, f"BTC API HTTP {r.status}"
+            j = await r.json(loads=orjson.loads, content_type=None)
         cs = j.get("chain_stats", {})
         funded = cs.get("funded_txo_sum", 0)
         spent = cs.get("spent_txo_sum", 0)
@@ -153,12 +237,12 @@ def sync_check_btc(address: str):
     except Exception as e:
         return False, f"BTC API error: {e}"
 
-def sync_check_ton(address: str):
+async def check_ton(session: aiohttp.ClientSession, address: str):
     try:
-        r = requests.get(TON_API_BASE + address, timeout=10)
-        if r.status_code != 200:
-            return False, f"TON API HTTP {r.status_code}"
-        j = r.json()
+        async with session.get(TON_API_BASE + address) as r:
+            if r.status != 200:
+                return False, f"TON API HTTP {r.status}"
+            j = await r.json(loads=orjson.loads, content_type=None)
         # toncenter returns {"ok":true,"result":<nanotons>} or similar for this endpoint
         result = j.get("result")
         if result is None:
@@ -169,10 +253,58 @@ def sync_check_ton(address: str):
         return False, f"TON API error: {e}"
 # ---------------------------------------------------------------------------------
 
-# async wrappers (run sync functions on threadpool)
-async def run_in_executor(func, *args):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, partial(func, *args))
+# ---------------- result cache ----------------
+# (token, address) -> (monotonic timestamp, (ok, info)); oldest entries evicted first.
+CACHE_TTL = 30
+CACHE_MAX = 4096
+_CACHE = OrderedDict()
+# (token, address) -> task of the lookup currently running for it (singleflight)
+_INFLIGHT = {}
+
+async def _fetch(key, fn, *args):
+    try:
+        result = await asyncio.wait_for(fn(*args), timeout=CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("%s check timed out for %s", *key)
+        return False, "RPC timeout"
+    if result[0]:
+        # only successful lookups are cached so a transient RPC error is not replayed
+        _CACHE[key] = (time.monotonic(), result)
+        _CACHE.move_to_end(key)
+        if len(_CACHE) > CACHE_MAX:
+            _CACHE.popitem(last=False)
+    return result
+
+async def cached_check(token: str, address: str, fn, *args):
+    """Await fn(*args), caching successes for CACHE_TTL and sharing one lookup per (token, address)."""
+    key = (token, address)
+    hit = _CACHE.get(key)
+    if hit is not None:
+        if time.monotonic() - hit[0] < CACHE_TTL:
+            _CACHE.move_to_end(key)
+            return hit[1]
+        del _CACHE[key]
+
+    fut = _INFLIGHT.get(key)
+    if fut is None:
+        fut = _INFLIGHT[key] = asyncio.ensure_future(_fetch(key, fn, *args))
+        fut.add_done_callback(lambda _: _INFLIGHT.pop(key, None))
+    # shield so one cancelled caller does not cancel the lookup for the others
+    return await asyncio.shield(fut)
+
+# ---------------- application lifecycle ----------------
+async def post_init(application):
+    # bounded pool for the blocking web3 checks (asyncio.to_thread uses the default executor)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=RPC_WORKERS, thread_name_prefix="w3")
+    )
+    # one pooled aiohttp session for all BTC/TON lookups
+    application.bot_data["http_session"] = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+
+async def post_shutdown(application):
+    session = application.bot_data.pop("http_session", None)
+    if session is not None:
+        await session.close()
 
 # ---------------- Telegram handlers ----------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -187,44 +319,44 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     token = query.data
+    # record the choice before any await so a concurrently handled address uses it
     user_choice[query.from_user.id] = token
+    await query.answer()
     await query.message.reply_text(f"Send me the {token} address for checking.")
 
 async def handle_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.message.from_user.id
-    if uid not in user_choice:
+    token = user_choice.get(uid)
+    if token is None:
         await update.message.reply_text("Please use /start first and select a token.")
         return
-    token = user_choice[uid]
+    user_choice[uid] = token  # refresh the TTL
     address = update.message.text.strip()
     logger.info("User %s requested %s check for address: %s", uid, token, address)
 
     # Basic format checks
-    if token in ("BNB", "ETH", "USDT") and not RE_EVM.fullmatch(address):
-        await update.message.reply_text("❌ Invalid EVM-style address format (must be 0x...).")
-        return
-    if token == "BTC" and not RE_BTC.fullmatch(address):
-        await update.message.reply_text("❌ Invalid BTC address format.")
-        return
-    if token == "TON" and not RE_TON.fullmatch(address):
-        await update.message.reply_text("❌ Invalid TON address format.")
-        return
+    if token in VALIDATORS:
+        check, err = VALIDATORS[token]
+        if not check(address):
+            await update.message.reply_text(err)
+            return
 
     await update.message.reply_text("🔍 Checking... This may take a second.")
 
     # Perform checks
     if token == "BNB":
-        ok, info = await run_in_executor(sync_check_rpc_native, address, BSC_RPC)
+        ok, info = await cached_check(token, address, asyncio.to_thread, sync_check_rpc_native, address, BSC_RPC)
     elif token == "ETH":
-        ok, info = await run_in_executor(sync_check_rpc_native, address, ETH_RPC)
+        ok, info = await cached_check(token, address, asyncio.to_thread, sync_check_rpc_native, address, ETH_RPC)
     elif token == "USDT":
-        ok, info = await run_in_executor(sync_check_rpc_token, address, BSC_RPC, USDT_BSC_CONTRACT)
+        ok, info = await cached_check(
+            token, address, asyncio.to_thread, sync_check_rpc_token, address, BSC_RPC, USDT_BSC_CONTRACT
+        )
     elif token == "BTC":
-        ok, info = await run_in_executor(sync_check_btc, address)
+        ok, info = await cached_check(token, address, check_btc, context.bot_data["http_session"], address)
     elif token == "TON":
-        ok, info = await run_in_executor(sync_check_ton, address)
+        ok, info = await cached_check(token, address, check_ton, context.bot_data["http_session"], address)
     else:
         ok, info = False, "Unknown token selection."
 
@@ -233,8 +365,32 @@ async def handle_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ---------------- main ----------------
 if __name__ == "__main__":
     logger.info("Starting bot. web3 available: %s", WEB3_AVAILABLE)
-    app = ApplicationBuilder().token(TOKEN).build()
+    # connectivity is checked once here (warming the same session the checks use)
+    for name, url in (("BSC", BSC_RPC), ("ETH", ETH_RPC)):
+        try:
+            (block,) = rpc_batch(url, _BLOCK_NUMBER_BODY, ("eth_blockNumber",))
+            logger.info("%s RPC connected, block %s", name, int(block, 16))
+        except Exception as e:
+            logger.warning("%s RPC not reachable: %s", name, e)
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_address))
-    app.run_polling()
+    if USE_WEBHOOK:
+        logger.info("Running in webhook mode on port %s", PORT)
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=TOKEN,
+            webhook_url=f"{PUBLIC_URL.rstrip('/')}/{TOKEN}",
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        app.run_polling()